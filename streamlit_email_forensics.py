@@ -1,303 +1,748 @@
+import hashlib
+import io
+import mmap
 import os
+import re
+import sqlite3
 import tempfile
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import streamlit as st
 from datetime import datetime
+from xml.sax.saxutils import escape
 
 # ReportLab for PDF export
+from reportlab import rl_config
 from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.platypus import SimpleDocTemplate, LongTable, TableStyle, Paragraph, Spacer
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet
 
-# msg_parser for parsing .msg files (incl. RTF→HTML)
+# Skip ReportLab's per-shape argument validation and build the sample
+# stylesheet once rather than per export.
+rl_config.shapeChecking = 0
+PDF_STYLES = getSampleStyleSheet()
+
+# Rows per Table flowable in the filtered report; one huge Table lays out
+# super-linearly, a run of small ones stays linear in the row count.
+PDF_TABLE_CHUNK_ROWS = 200
+# Longer cells are cut (with an ellipsis) in the filtered report: a single
+# huge recipients/contacts cell otherwise dominates table layout
+PDF_CELL_MAX_CHARS = 500
+PDF_TABLE_STYLE = TableStyle([
+    ("BACKGROUND", (0, 0), (-1, 0), colors.grey),
+    ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
+    ("ALIGN", (0, 0), (-1, -1), "LEFT"),
+    ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+    ("FONTSIZE", (0, 0), (-1, 0), 10),
+    ("BOTTOMPADDING", (0, 0), (-1, 0), 8),
+    ("GRID", (0, 0), (-1, -1), 0.5, colors.black),
+])
+
+# msg_parser for parsing .msg files (incl. RTF→HTML); olefile is its OLE2 reader
+import olefile
 from msg_parser import MsOxMessage
 
+# google-re2 scans bodies in linear time with no backtracking; fall back to
+# the stdlib engine when it isn't installed.
+try:
+    import re2 as regex_engine
+except ImportError:
+    regex_engine = re
+
+# Character classes (bodies of [...]) for word chars, digits and whitespace.
+# re2's \w, \d, \s and \b are ASCII-only, so for re2 they are spelled out as
+# the Unicode classes stdlib re uses; both engines then report the same
+# matches (e.g. josé.müller@exämple.de, non-ASCII digits).
+if regex_engine is re:
+    WORD_CLASS, DIGIT_CLASS, SPACE_CLASS = r"\w", r"\d", r"\s"
+else:
+    WORD_CLASS = r"\p{L}\p{N}_"
+    DIGIT_CLASS = r"\p{Nd}"
+    SPACE_CLASS = r"\t\n\x0b\f\r\x1c-\x1f\x85\p{Z}"
+
+# Email addresses / phone numbers found in message bodies (compiled once).
+# Kept as two patterns scanned separately: a phone number inside an address
+# (e.g. an SMS gateway like 2125551234@vtext.com) must still be reported.
+# No \b: starting on a word char and ending on a greedy word run matches
+# exactly what the \b-anchored form did.
+EMAIL_RE = regex_engine.compile(rf"[{WORD_CLASS}][{WORD_CLASS}.-]*@[{WORD_CLASS}.-]+\.[{WORD_CLASS}]+")
+PHONE_RE = regex_engine.compile(
+    rf"(?:\+?[{DIGIT_CLASS}]{{1,3}}[-.{SPACE_CLASS}]?)?\(?[{DIGIT_CLASS}]{{3}}\)?"
+    rf"[-.{SPACE_CLASS}]?[{DIGIT_CLASS}]{{3}}[-.{SPACE_CLASS}]?[{DIGIT_CLASS}]{{4}}"
+)
+
+# Text columns the sidebar filters search (case-insensitively)
+FILTER_COLUMNS = ("subject", "sender", "recipients", "emails_in_body", "phones_in_body", "body")
+
+# Columns the filtered view carries; bodies (the bulk of the corpus) live in
+# the SQLite body store and are only read for the selected message or an export
+VIEW_COLUMNS = ("date", "subject", "sender", "recipients", "emails_in_body",
+                "phones_in_body", "attachments", "attachments_count")
+
 # ----------------------------------------
 # .msg Parsing via msg_parser
 # ----------------------------------------
-@st.cache_data
-def parse_msg_files(_msg_files):
+def _coerce_dates(raw_dates):
+    """
+    Convert raw date values (datetime, ISO string or None) in a single
+    vectorized pass. Unparseable values become NaT.
+    Always returns naive datetime64 (UTC wall time for values with an
+    offset), so the column compares directly with the naive date filter
+    bounds whether the values are naive, aware or a mix.
+    """
+    raw = pd.Series(raw_dates, dtype=object)
+    return pd.to_datetime(raw, errors="coerce", format="ISO8601", utc=True).dt.tz_localize(None)
+
+
+def _parse_one_msg(file_bytes, name):
+    """
+    Parse the raw bytes of one .msg file (`name` is used in error messages).
+    Returns (date, subject, sender, recipients, body, attachments) where
+    attachments is a list of (filename, sha256 hex digest, raw bytes). Safe
+    to run in a worker thread: it touches no shared state.
+    """
+    # msg_parser only validates paths, not streams: check the OLE2 header here
+    # so a corrupt member fails with a clear error naming it
+    if not olefile.isOleFile(data=file_bytes):
+        raise ValueError(f"{name} is not a valid .msg file (not an OLE2 compound file)")
+
+    # Parse with msg_parser straight from memory (olefile reads file-like objects)
+    msg = MsOxMessage(io.BytesIO(file_bytes))
+    props = msg.get_properties()
+
+    # Date (coerced column-wise by the caller)
+    date = props.get("DeliveryTime") or props.get("SentOn") or None
+
+    # Subject, Sender
+    subject = props.get("Subject", "")
+    sender = props.get("SenderName", "") or props.get("FromDisplayName", "")
+
+    # Recipients: 'To', 'Cc', 'Bcc'
+    to_list = props.get("To", []) or []
+    cc_list = props.get("Cc", []) or []
+    bcc_list = props.get("Bcc", []) or []
+    recipients = ", ".join(to_list + cc_list + bcc_list)
+
+    # Body: prefer HTML, fallback to plain text
+    html_body = props.get("Html", "").strip() or None
+    text_body = props.get("Body", "").strip() or None
+    body = html_body or text_body or ""
+
+    # Attachments: msg_parser returns a list of dicts with 'filename' and 'content'
+    attachments = []
+    for att in msg.attachments:
+        data = att.get("content", b"")
+        attachments.append((att.get("filename", "attachment"), hashlib.sha256(data).hexdigest(), data))
+
+    msg.close()
+
+    return date, subject, sender, recipients, body, attachments
+
+
+def _extract_contacts(body):
+    """
+    Scan a body for email addresses and phone numbers.
+    Returns (emails, phones) as comma-joined strings, deduplicated in
+    first-seen order.
+    """
+    emails = dict.fromkeys(EMAIL_RE.findall(body))
+    phones = dict.fromkeys(PHONE_RE.findall(body))
+    return ", ".join(emails), ", ".join(phones)
+
+
+def parse_msg_files(msg_files):
     """
     Parse a list of .msg files (UploadedFile-like objects) using msg_parser.
+    Files are parsed concurrently in a thread pool; results keep upload order.
+    Not cached itself: it runs under parse_zip_file's resource cache.
     Returns (messages, attachments_storage).
-    - messages: list of dicts with keys:
-        date (datetime), subject, sender, recipients, body,
-        emails_in_body, phones_in_body, attachments (list of (filename, key))
-    - attachments_storage: dict mapping key -> raw bytes
+    - messages: DataFrame with one row per message and columns:
+        date (datetime64), subject, sender, recipients, body,
+        emails_in_body, phones_in_body, attachments (list of (filename, key)),
+        attachments_count (int16); sender/subject/recipients are
+        categoricals.
+        Hidden _<col>_lc columns hold lowercased copies of the filterable
+        text columns (FILTER_COLUMNS) so filters never re-lowercase per rerun.
+    - attachments_storage: dict mapping key -> raw bytes, deduplicated by
+      content hash
     """
-    messages = []
+    # Each worker reads its own file, so only about one raw .msg buffer per
+    # worker is alive at a time (not the whole decompressed archive).
+    # ZipExtFile reads are safe across threads: the archive handle is locked.
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        parsed = list(executor.map(lambda uploaded: _parse_one_msg(uploaded.read(), uploaded.name), msg_files))
+
+    raw_dates = []
+    subjects = []
+    senders = []
+    recipients_col = []
+    bodies = []
+    attachment_lists = []
     attachments_storage = {}
+    blobs = {}
+
+    for date, subject, sender, recipients, body, attachments in parsed:
+        raw_dates.append(date)
+        subjects.append(subject)
+        senders.append(sender)
+        recipients_col.append(recipients)
+        bodies.append(body)
+
+        # Keys are content-addressed ("<sha256>_<filename>"): the same file
+        # attached to many messages is stored once, and the same bytes under
+        # different names share a single buffer
+        keyed = []
+        for fname, digest, data in attachments:
+            key = f"{digest}_{fname}"
+            if key not in attachments_storage:
+                attachments_storage[key] = blobs.setdefault(digest, data)
+            keyed.append((fname, key))
+        attachment_lists.append(keyed)
+
+    # Column-wise post-processing: dates and body emails/phones are derived
+    # once per column instead of once per message.
+    dates = _coerce_dates(raw_dates)
+    contacts = [_extract_contacts(body) for body in bodies]
+    emails_col = [emails for emails, _ in contacts]
+    phones_col = [phones for _, phones in contacts]
+
+    messages = pd.DataFrame({
+        "date": dates,
+        "subject": subjects,
+        "sender": senders,
+        "recipients": recipients_col,
+        "body": bodies,
+        "emails_in_body": emails_col,
+        "phones_in_body": phones_col,
+        "attachments": attachment_lists,
+    })
+    # Missing properties become "" (never "nan"/"None") in every text column.
+    # The explicit string dtype keeps .str usable below even with zero rows,
+    # where pandas would otherwise infer float columns.
+    text_cols = list(FILTER_COLUMNS)
+    messages[text_cols] = messages[text_cols].fillna("").astype("str")
+    # Downcast: senders/subjects/recipient lists repeat heavily across a mailbox
+    messages["sender"] = messages["sender"].astype("category")
+    messages["subject"] = messages["subject"].astype("category")
+    messages["recipients"] = messages["recipients"].astype("category")
+    messages["attachments_count"] = messages["attachments"].map(len).astype("int16")
+
+    for col in FILTER_COLUMNS:
+        lowered = messages[col].str.lower()
+        if isinstance(messages[col].dtype, pd.CategoricalDtype):
+            lowered = lowered.astype("category")
+        messages[f"_{col}_lc"] = lowered
 
-    for uploaded in _msg_files:
-        # Save UploadedFile to a temp .msg
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".msg") as tmp:
-            tmp.write(uploaded.read())
-            tmp_path = tmp.name
+    return messages, attachments_storage
 
-        # Parse with msg_parser
-        msg = MsOxMessage(tmp_path)
-        props = msg.get_properties()
 
-        # Date
-        msg_date = props.get("DeliveryTime") or props.get("SentOn") or None
-        if isinstance(msg_date, str):
-            try:
-                msg_date = datetime.fromisoformat(msg_date)
-            except Exception:
-                msg_date = None
-        if not isinstance(msg_date, datetime):
-            msg_date = None
-
-        # Subject, Sender
-        msg_subject = props.get("Subject", "")
-        msg_sender = props.get("SenderName", "") or props.get("FromDisplayName", "")
-
-        # Recipients: 'To', 'Cc', 'Bcc'
-        to_list = props.get("To", []) or []
-        cc_list = props.get("Cc", []) or []
-        bcc_list = props.get("Bcc", []) or []
-        recipients = ", ".join(to_list + cc_list + bcc_list)
-
-        # Body: prefer HTML, fallback to plain text
-        html_body = props.get("Html", "").strip() or None
-        text_body = props.get("Body", "").strip() or None
-        # Use HTML if available; otherwise plain text
-        body = html_body or text_body or ""
-
-        # Extract email addresses & phone numbers from the body text
-        import re
-        emails_in_body = re.findall(r"\b[\w\.-]+@[\w\.-]+\.\w+\b", body)
-        phones_in_body = re.findall(
-            r"(\+?\d{1,3}[-\.\s]?)?\(?\d{3}\)?[-\.\s]?\d{3}[-\.\s]?\d{4}", body
-        )
-        emails_in_body = list(dict.fromkeys(emails_in_body))
-        phones_in_body = ["".join(p) for p in phones_in_body]
-        phones_in_body = list(dict.fromkeys(phones_in_body))
-
-        # Attachments: msg_parser returns a list of dicts with 'filename' and 'data'
-        for att in msg.attachments:
-            fname = att.get("filename", "attachment")
-            data = att.get("content", b"")
-            key = f"{len(attachments_storage)}_{fname}"
-            attachments_storage[key] = data
-
-        attachment_list = [(att["filename"], f"{i}_{att['filename']}") 
-                           for i, att in enumerate(msg.attachments)]
-
-        messages.append({
-            "date": msg_date,
-            "subject": msg_subject,
-            "sender": msg_sender,
-            "recipients": recipients,
-            "body": body,
-            "emails_in_body": ", ".join(emails_in_body),
-            "phones_in_body": ", ".join(phones_in_body),
-            "attachments": attachment_list,
-        })
+# ----------------------------------------
+# Parquet cache of parsed corpora (keyed by ZIP hash)
+# ----------------------------------------
+# Opt-in: the cache keeps whole mailboxes (bodies and attachments included)
+# on disk, so nothing is persisted unless EMAIL_FORENSICS_CACHE_DIR is set.
+CACHE_DIR = os.environ.get("EMAIL_FORENSICS_CACHE_DIR") or None
 
-        msg.close()
-        os.unlink(tmp_path)
 
-    return messages, attachments_storage
+def _cache_paths(digest):
+    return (os.path.join(CACHE_DIR, f"{digest}.messages.parquet"),
+            os.path.join(CACHE_DIR, f"{digest}.attachments.parquet"))
+
+
+def _load_cached_corpus(digest):
+    """
+    Load a previously parsed corpus from the Parquet cache and its body store.
+    Returns (messages, attachments_storage, bodies), or None on a cache miss.
+    """
+    if CACHE_DIR is None:
+        return None
+    messages_path, attachments_path = _cache_paths(digest)
+    if not (os.path.exists(messages_path) and os.path.exists(attachments_path)):
+        return None
+    bodies = _open_body_store(digest)
+    if bodies is None:
+        return None
+    try:
+        messages = pd.read_parquet(messages_path)
+        attachments = pd.read_parquet(attachments_path, columns=["key", "data"])
+    except (ImportError, OSError, ValueError, KeyError):
+        bodies.close()
+        return None
+    attachments_storage = _store_attachments(dict(zip(attachments["key"], attachments["data"])))
+
+    # Parquet has no list-of-tuples type; attachments are stored as two list columns
+    pos = messages.columns.get_loc("attachment_names")
+    names, keys = messages.pop("attachment_names"), messages.pop("attachment_keys")
+    messages.insert(pos, "attachments", [list(zip(n, k)) for n, k in zip(names, keys)])
+    return messages, attachments_storage, bodies
+
+
+def _store_cached_corpus(digest, messages, attachments_storage):
+    """
+    Persist a parsed corpus to the Parquet cache, if one is configured. Best
+    effort: without pyarrow (or a writable cache dir) the corpus is simply
+    re-parsed next time.
+    """
+    if CACHE_DIR is None:
+        return
+    messages_path, attachments_path = _cache_paths(digest)
+    pos = messages.columns.get_loc("attachments")
+    flat = messages.drop(columns="attachments")
+    flat.insert(pos, "attachment_keys", messages["attachments"].map(lambda atts: [key for _, key in atts]))
+    flat.insert(pos, "attachment_names", messages["attachments"].map(lambda atts: [fn for fn, _ in atts]))
+    attachments = pd.DataFrame({
+        "key": list(attachments_storage.keys()),
+        "data": list(attachments_storage.values()),
+    })
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        flat.to_parquet(messages_path, compression="zstd")
+        attachments.to_parquet(attachments_path, compression="zstd")
+    except (ImportError, OSError):
+        pass
 
 
 # ----------------------------------------
-# ZIP Handling: extract .msg files
+# Attachment store (one mmap'd temp file per corpus)
 # ----------------------------------------
-@st.cache_data
-def parse_zip_file(uploaded_zip):
+def _write_attachments(blob_file, attachments_storage):
     """
-    Extract all .msg files from the uploaded ZIP and parse them via msg_parser.
-    Returns (messages, attachments_storage).
+    Append every distinct attachment buffer to `blob_file` once (keys sharing
+    a content hash share one buffer). Returns key -> (offset, length).
+    """
+    index = {}
+    offsets = {}
+    offset = 0
+    for key, data in attachments_storage.items():
+        if id(data) not in offsets:
+            offsets[id(data)] = offset
+            blob_file.write(data)
+            offset += len(data)
+        index[key] = (offsets[id(data)], len(data))
+    blob_file.flush()
+    return index
+
+
+def _map_attachments(blob_file, index):
+    """
+    Map the blob file read-only and return key -> zero-copy memoryview slice.
+    Pages are faulted in only when an attachment is actually read, and the
+    OS can drop them again under memory pressure.
+    """
+    if os.fstat(blob_file.fileno()).st_size == 0:
+        return {key: b"" for key in index}
+    view = memoryview(mmap.mmap(blob_file.fileno(), 0, access=mmap.ACCESS_READ))
+    return {key: view[offset:offset + length] for key, (offset, length) in index.items()}
+
+
+def _store_attachments(attachments_storage):
+    """
+    Spill attachment bytes out of the heap into a single append-only
+    anonymous temp file. It has no name on disk and goes away once the
+    mapping is dropped (when the corpus leaves parse_zip_file's cache).
+    Returns key -> memoryview; see _map_attachments.
+    """
+    with tempfile.TemporaryFile() as blob_file:
+        index = _write_attachments(blob_file, attachments_storage)
+        return _map_attachments(blob_file, index)
+
+
+# ----------------------------------------
+# Body store (SQLite next to the Parquet cache)
+# ----------------------------------------
+def _body_store_path(digest):
+    return os.path.join(CACHE_DIR, f"{digest}.bodies.sqlite")
+
+
+def _fill_body_store(conn, rows):
+    conn.execute("CREATE TABLE bodies (row INTEGER PRIMARY KEY, body TEXT, body_lc TEXT)")
+    conn.executemany("INSERT INTO bodies VALUES (?, ?, ?)", rows)
+    conn.commit()
+    return conn
+
+
+def _open_body_store(digest):
+    """
+    Open the body store of a previously parsed corpus, or None if it's missing.
     """
-    with tempfile.TemporaryDirectory() as tmpdir:
-        zip_path = os.path.join(tmpdir, uploaded_zip.name)
-        with open(zip_path, "wb") as f:
-            f.write(uploaded_zip.read())
+    path = _body_store_path(digest)
+    if not os.path.exists(path):
+        return None
+    try:
+        return sqlite3.connect(path, check_same_thread=False)
+    except sqlite3.Error:
+        return None
+
+
+def _store_bodies(digest, bodies, bodies_lc):
+    """
+    Move message bodies (and their lowercased copies) out of the DataFrame
+    into a SQLite table keyed by row label. Written under CACHE_DIR (when
+    set) so later sessions reuse it; otherwise, or when the cache dir isn't
+    writable, SQLite's private temporary database is used, which lives on
+    disk only until the connection closes. Returns the open connection.
+    """
+    rows = list(zip(bodies.index.tolist(), bodies.tolist(), bodies_lc.tolist()))
+    if CACHE_DIR is None:
+        return _fill_body_store(sqlite3.connect("", check_same_thread=False), rows)
+    tmp_path = None
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Build under a temp name so a half-written store is never picked up
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=CACHE_DIR)
+        os.close(fd)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            _fill_body_store(conn, rows)
+        finally:
+            conn.close()
+        path = _body_store_path(digest)
+        os.replace(tmp_path, path)
+        return sqlite3.connect(path, check_same_thread=False)
+    except (OSError, sqlite3.Error):
+        # Don't leave the half-built store behind in CACHE_DIR
+        if tmp_path is not None and os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        return _fill_body_store(sqlite3.connect("", check_same_thread=False), rows)
+
 
-        with zipfile.ZipFile(zip_path, "r") as zip_ref:
-            zip_ref.extractall(tmpdir)
+def load_body(bodies, row):
+    """Fetch the body of a single message by row label."""
+    found = bodies.execute("SELECT body FROM bodies WHERE row = ?", (int(row),)).fetchone()
+    return found[0] if found else ""
 
-        msg_file_paths = []
-        for root, _, files in os.walk(tmpdir):
-            for name in files:
-                if name.lower().endswith(".msg"):
-                    msg_file_paths.append(os.path.join(root, name))
 
-        class _TmpUploaded:
-            def __init__(self, path):
-                self.name = os.path.basename(path)
-                self._path = path
+def _load_bodies(bodies, rows):
+    """Fetch the bodies of many messages, in the order of `rows`."""
+    rows = [int(row) for row in rows]
+    found = {}
+    # Stay well below SQLite's bound-parameter limit per query
+    for start in range(0, len(rows), 500):
+        chunk = rows[start:start + 500]
+        placeholders = ", ".join("?" * len(chunk))
+        found.update(bodies.execute(f"SELECT row, body FROM bodies WHERE row IN ({placeholders})", chunk))
+    return [found.get(row, "") for row in rows]
 
-            def read(self):
-                with open(self._path, "rb") as f:
-                    return f.read()
 
-        msg_uploads = [_TmpUploaded(p) for p in msg_file_paths]
-        return parse_msg_files(msg_uploads)
+def _search_bodies(bodies, text):
+    """Row labels of the messages whose body contains `text` (case-insensitive)."""
+    cursor = bodies.execute("SELECT row FROM bodies WHERE instr(body_lc, ?) > 0", (text.lower(),))
+    return [row for row, in cursor]
+
+
+# ----------------------------------------
+# ZIP Handling: extract .msg files
+# ----------------------------------------
+@st.cache_resource(max_entries=4)
+def parse_zip_file(_uploaded_zip, upload_key):
+    """
+    Read all .msg files from the uploaded ZIP and parse them via msg_parser.
+    Cached as a resource keyed on `upload_key` (the upload's file_id): reruns
+    get the same objects back with no hashing of the ZIP and no pickle
+    round-trip, so callers must treat the result as read-only.
+    When a cache dir is configured, results are also persisted to the
+    Parquet cache, so re-uploading the same ZIP in a later session skips
+    parsing. Bodies are moved out of the frame into the SQLite body store,
+    and attachment bytes into an mmap'd temp file, so `attachments_storage`
+    maps key -> read-only memoryview.
+    Returns (messages, attachments_storage, bodies); `bodies` is the body
+    store connection (see load_body).
+    """
+    # Zero-copy view of the in-memory upload (read() would duplicate it)
+    zip_buffer = _uploaded_zip.getbuffer()
+    digest = hashlib.sha256(zip_buffer).hexdigest()
+    cached = _load_cached_corpus(digest)
+    if cached is not None:
+        return cached
+
+    # Read .msg members straight out of the in-memory archive: no extraction
+    # to disk, no directory walk. ZipExtFile objects are file-like (.name,
+    # .read()), which is all parse_msg_files needs.
+    with zipfile.ZipFile(_uploaded_zip, "r") as zip_ref:
+        msg_entries = [
+            zip_ref.open(info) for info in zip_ref.infolist()
+            if not info.is_dir() and info.filename.lower().endswith(".msg")
+        ]
+        messages, attachments_storage = parse_msg_files(msg_entries)
+
+    bodies = _store_bodies(digest, messages.pop("body"), messages.pop("_body_lc"))
+    _store_cached_corpus(digest, messages, attachments_storage)
+    attachments_storage = _store_attachments(attachments_storage)
+    return messages, attachments_storage, bodies
+
+
+# ----------------------------------------
+# Filtering
+# ----------------------------------------
+def _contains(messages, col, text):
+    """
+    Case-insensitive substring mask for one filterable column, matched against
+    its pre-lowercased _<col>_lc copy.
+    """
+    values = messages[f"_{col}_lc"]
+    text = text.lower()
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Scan each distinct value once, then broadcast through the codes
+        hits = values.cat.categories.str.contains(text, regex=False)
+        return values.cat.codes.isin(hits.nonzero()[0])
+    return values.str.contains(text, regex=False, na=False)
+
+
+@st.cache_data(max_entries=32)
+def filter_messages(_messages, _bodies, corpus_key, subj_filter, sender_filter, rec_filter, email_filter,
+                    phone_filter, body_filter, has_attach, start_date, end_date):
+    """
+    Apply the sidebar filters as vectorized boolean masks over the message
+    columns (the body filter searches the body store). Cached on
+    (corpus_key, filter values); `_messages`/`_bodies` are not hashed.
+    Returns a tuple of the matching row labels.
+    """
+    messages = _messages
+    mask = pd.Series(True, index=messages.index)
+    if subj_filter:
+        mask &= _contains(messages, "subject", subj_filter)
+    if sender_filter:
+        mask &= _contains(messages, "sender", sender_filter)
+    if rec_filter:
+        mask &= _contains(messages, "sender", rec_filter) | _contains(messages, "recipients", rec_filter)
+    if email_filter:
+        mask &= _contains(messages, "emails_in_body", email_filter)
+    if phone_filter:
+        mask &= _contains(messages, "phones_in_body", phone_filter)
+    if body_filter:
+        mask &= messages.index.isin(_search_bodies(_bodies, body_filter))
+    if has_attach:
+        mask &= messages["attachments_count"] > 0
+    # Messages without a date are never excluded by the date range. The range
+    # is compared as datetime64 (end date inclusive) rather than via .dt.date,
+    # which would box every value into a Python date object.
+    msg_dates = messages["date"]
+    range_start = pd.Timestamp(start_date)
+    range_end = pd.Timestamp(end_date) + pd.Timedelta(days=1)
+    mask &= msg_dates.isna() | ((msg_dates >= range_start) & (msg_dates < range_end))
+    return tuple(messages.index[mask])
 
 
 # ----------------------------------------
 # CSV / PDF Export Helpers
 # ----------------------------------------
-@st.cache_data
-def generate_csv_download(messages):
-    df = pd.DataFrame([{
-        "Date": msg.get("date"),
-        "Subject": msg.get("subject"),
-        "Sender": msg.get("sender"),
-        "Recipients": msg.get("recipients"),
-        "EmailsInBody": msg.get("emails_in_body"),
-        "PhonesInBody": msg.get("phones_in_body"),
-        "Attachments": ";".join([att[0] for att in msg.get("attachments", [])]),
-        "Body": msg.get("body"),
-    } for msg in messages])
-
-    if not df.empty and isinstance(df.loc[0, "Date"], datetime):
-        df["Date"] = df["Date"].dt.strftime("%Y-%m-%d %H:%M:%S")
-
-    return df.to_csv(index=False).encode("utf-8")
-
-
-@st.cache_data
-def generate_pdf_download(messages):
-    buffer = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-    doc = SimpleDocTemplate(buffer.name, pagesize=letter)
+# The exporters are cached on `filter_key` only: the (corpus key, filter
+# values) tuple filter_messages is keyed on, which identifies the filtered
+# rows. `_messages`, `_bodies` and `_row_keys` are excluded from hashing, so a
+# rerun hashes a handful of values however many rows matched.
+# Each entry holds a whole export (the CSV includes every body), so only the
+# last few filter results are kept.
+@st.cache_data(max_entries=4)
+def generate_csv_download(_messages, _bodies, filter_key, _row_keys):
+    messages = _messages.loc[list(_row_keys)]
+    df = pd.DataFrame({
+        "Date": messages["date"].dt.strftime("%Y-%m-%d %H:%M:%S"),
+        "Subject": messages["subject"],
+        "Sender": messages["sender"],
+        "Recipients": messages["recipients"],
+        "EmailsInBody": messages["emails_in_body"],
+        "PhonesInBody": messages["phones_in_body"],
+        "Attachments": messages["attachments"].map(lambda atts: ";".join(att[0] for att in atts)),
+        "Body": _load_bodies(_bodies, _row_keys),
+    })
+
+    buf = io.BytesIO()
+    df.to_csv(buf, index=False, encoding="utf-8")
+    return buf.getvalue()
+
+
+def _truncate_cells(values, limit=PDF_CELL_MAX_CHARS):
+    """
+    Cut a column of cell text to `limit` characters, marking cut cells with
+    an ellipsis.
+    """
+    values = values.astype(str)
+    too_long = values.str.len() > limit
+    if not too_long.any():
+        return values
+    return values.where(~too_long, values.str.slice(0, limit) + "\u2026")
+
+
+@st.cache_data(max_entries=4)
+def generate_pdf_download(_messages, filter_key, _row_keys):
+    messages = _messages.loc[list(_row_keys)]
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
     elements = []
-    styles = getSampleStyleSheet()
+    styles = PDF_STYLES
 
     title = Paragraph("Filtered Email Report", styles["Title"])
     elements.append(title)
     elements.append(Spacer(1, 12))
 
-    table_data = [[
+    header = [
         "Date", "Subject", "Sender", "Recipients",
         "Emails In Body", "Phones In Body", "Attachments"
-    ]]
-
-    for msg in messages:
-        date_str = msg["date"].strftime("%Y-%m-%d %H:%M:%S") if msg.get("date") else ""
-        attachments_text = ";".join([att[0] for att in msg.get("attachments", [])])
-
-        row = [
-            date_str,
-            msg.get("subject", ""),
-            msg.get("sender", ""),
-            msg.get("recipients", ""),
-            msg.get("emails_in_body", ""),
-            msg.get("phones_in_body", ""),
-            attachments_text,
-        ]
-        table_data.append(row)
-
-    tbl = Table(table_data, repeatRows=1)
-    tbl.setStyle(TableStyle([
-        ("BACKGROUND", (0, 0), (-1, 0), colors.grey),
-        ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
-        ("ALIGN", (0, 0), (-1, -1), "LEFT"),
-        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-        ("FONTSIZE", (0, 0), (-1, 0), 10),
-        ("BOTTOMPADDING", (0, 0), (-1, 0), 8),
-        ("GRID", (0, 0), (-1, -1), 0.5, colors.black),
-    ]))
-    elements.append(tbl)
+    ]
+    # One LongTable per chunk of rows, each repeating the header. Rows are
+    # built per chunk and owned only by their table, so ReportLab can drop
+    # each chunk once it has been drawn.
+    for start in range(0, max(len(messages), 1), PDF_TABLE_CHUNK_ROWS):
+        chunk = messages.iloc[start:start + PDF_TABLE_CHUNK_ROWS]
+        # Rows are zipped straight from the chunk's columns; only the date
+        # and attachment names need formatting, each done column-wise
+        dates = chunk["date"].dt.strftime("%Y-%m-%d %H:%M:%S").fillna("")
+        attachments_text = chunk["attachments"].map(lambda atts: ";".join(att[0] for att in atts))
+
+        table_data = [header]
+        table_data.extend(zip(
+            dates,
+            _truncate_cells(chunk["subject"]),
+            _truncate_cells(chunk["sender"]),
+            _truncate_cells(chunk["recipients"]),
+            _truncate_cells(chunk["emails_in_body"]),
+            _truncate_cells(chunk["phones_in_body"]),
+            _truncate_cells(attachments_text),
+        ))
+
+        elements.append(LongTable(table_data, repeatRows=1, splitByRow=True, style=PDF_TABLE_STYLE))
 
     doc.build(elements)
-    with open(buffer.name, "rb") as f:
-        data = f.read()
-    os.unlink(buffer.name)
-    return data
+    return buffer.getvalue()
 
 
-def generate_single_pdf(msg):
+def generate_single_pdf(msg, body):
     """
     Create a PDF (bytes) for a single message, formatted as a detailed report.
+    `body` is the message body, fetched from the body store by the caller.
+    Text is escaped before it goes into a Paragraph: ReportLab parses its
+    own markup, and a stray "<b>" or "&" in a subject or HTML body would
+    otherwise fail the whole build.
     """
-    buffer = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-    doc = SimpleDocTemplate(buffer.name, pagesize=letter)
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
     elements = []
-    styles = getSampleStyleSheet()
+    styles = PDF_STYLES
 
     # Headers
-    elements.append(Paragraph(f"Date: {msg['date'].strftime('%Y-%m-%d %H:%M:%S')}", styles["Normal"]))
-    elements.append(Paragraph(f"Subject: {msg['subject']}", styles["Normal"]))
-    elements.append(Paragraph(f"Sender: {msg['sender']}", styles["Normal"]))
-    elements.append(Paragraph(f"Recipients: {msg['recipients']}", styles["Normal"]))
+    date_str = msg["date"].strftime("%Y-%m-%d %H:%M:%S") if pd.notna(msg["date"]) else ""
+    elements.append(Paragraph(f"Date: {date_str}", styles["Normal"]))
+    elements.append(Paragraph(f"Subject: {escape(str(msg['subject']))}", styles["Normal"]))
+    elements.append(Paragraph(f"Sender: {escape(str(msg['sender']))}", styles["Normal"]))
+    elements.append(Paragraph(f"Recipients: {escape(str(msg['recipients']))}", styles["Normal"]))
 
     if msg["attachments"]:
         elements.append(Spacer(1, 12))
         elements.append(Paragraph("Attachments:", styles["Normal"]))
         for fn, _ in msg["attachments"]:
-            elements.append(Paragraph(f"• {fn}", styles["Normal"]))
+            elements.append(Paragraph(f"• {escape(fn)}", styles["Normal"]))
 
     # Body
     elements.append(Spacer(1, 12))
     elements.append(Paragraph("Body:", styles["Normal"]))
-    for line in msg["body"].split("\n"):
+    for line in body.split("\n"):
         if line.strip() == "":
             elements.append(Spacer(1, 6))
         else:
-            elements.append(Paragraph(line, styles["Normal"]))
+            elements.append(Paragraph(escape(line), styles["Normal"]))
 
     doc.build(elements)
-    with open(buffer.name, "rb") as f:
-        data = f.read()
-    os.unlink(buffer.name)
-    return data
+    return buffer.getvalue()
+
+
+# Each entry holds a whole ZIP of PDFs, so only the last few are kept
+@st.cache_data(max_entries=4)
+def generate_pdfs_zip(_messages, _bodies, filter_key, _row_keys):
+    """
+    Build one detailed PDF per message (see generate_single_pdf) and bundle
+    them as message_<index>.pdf in a ZIP (bytes). Rendered serially: ReportLab
+    holds the GIL, so a thread pool gave no speedup.
+    Entries are stored, not deflated: PDF streams are already compressed.
+    """
+    messages = _messages.loc[list(_row_keys)]
+    bodies = _load_bodies(_bodies, _row_keys)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as zf:
+        for (row, msg), body in zip(messages.iterrows(), bodies):
+            zf.writestr(f"message_{row}.pdf", generate_single_pdf(msg, body))
+    return buffer.getvalue()
 
 
 # ----------------------------------------
 # Split-Zip Helper for Attachments
 # ----------------------------------------
+# Attachments that are already compressed are stored as-is in the split ZIPs;
+# deflating them again costs CPU for next to no size reduction
+PRECOMPRESSED_EXTENSIONS = {
+    ".pdf", ".zip", ".docx", ".xlsx", ".pptx", ".jpg", ".jpeg", ".png", ".gif",
+    ".mp3", ".mp4", ".mov", ".7z", ".gz", ".rar",
+}
+PRECOMPRESSED_MAGIC = (b"%PDF", b"PK\x03\x04", b"\xff\xd8\xff", b"\x89PNG", b"GIF8", b"\x1f\x8b", b"7z\xbc\xaf")
+
+
+def _zip_compress_type(fname, data):
+    if os.path.splitext(fname)[1].lower() in PRECOMPRESSED_EXTENSIONS or bytes(data[:8]).startswith(PRECOMPRESSED_MAGIC):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def _unique_arcname(fname, used_names):
+    """
+    Return `fname`, or "name (2).ext", "name (3).ext", ... if that name is
+    already taken (compared case-insensitively, as most file systems do).
+    """
+    stem, ext = os.path.splitext(fname)
+    arcname, n = fname, 1
+    while arcname.lower() in used_names:
+        n += 1
+        arcname = f"{stem} ({n}){ext}"
+    used_names.add(arcname.lower())
+    return arcname
+
+
 def create_split_zips(attachments_storage, size_limit=190 * 1024 * 1024):
     """
-    Given attachments_storage (key -> bytes), create multiple ZIP files beneath size_limit.
-    Returns list of (zip_filename, zip_bytes).
-    """
-    items = list(attachments_storage.items())
-    zips = []
-    current_zip_file = None
-    current_zip = None
-    current_size = 0
-    part_index = 1
-
-    def finalize_zip(zf, tmp_path):
-        zf.close()
-        with open(tmp_path, "rb") as f:
-            data = f.read()
-        os.unlink(tmp_path)
-        return data
-
-    # Start first ZIP
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
-    current_zip_file = tmp.name
-    zf = zipfile.ZipFile(current_zip_file, mode="w", compression=zipfile.ZIP_DEFLATED)
-    current_size = 0
-
-    for key, data in items:
-        fname = key.split("_", 1)[1]
-        file_size = len(data)
-        # If adding this would exceed limit, finalize current and start a new one
-        if current_size + file_size > size_limit and current_size > 0:
-            zip_bytes = finalize_zip(zf, current_zip_file)
-            zips.append((f"attachments_part{part_index}.zip", zip_bytes))
-            part_index += 1
-            tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
-            current_zip_file = tmp.name
-            zf = zipfile.ZipFile(current_zip_file, mode="w", compression=zipfile.ZIP_DEFLATED)
-            current_size = 0
-
-        zf.writestr(fname, data)
-        current_size += file_size
-
-    # Finalize last
-    if zf:
-        zip_bytes = finalize_zip(zf, current_zip_file)
-        zips.append((f"attachments_part{part_index}.zip", zip_bytes))
-
-    return zips
+    Given attachments_storage (key -> bytes), pack the attachments into ZIP
+    parts whose contents stay beneath size_limit (first-fit decreasing, so
+    fewer parts are needed). Parts are built in memory; already-compressed
+    files are stored rather than deflated again. Different files sharing a
+    name get a numbered suffix, so extracting every part into one folder
+    overwrites nothing.
+    Yields (zip_filename, zip_bytes) one part at a time.
+    """
+    parts = []  # [contents size, [(arcname, data), ...]]
+    used_names = set()
+    for key, data in sorted(attachments_storage.items(), key=lambda item: len(item[1]), reverse=True):
+        fname = _unique_arcname(key.split("_", 1)[1], used_names)
+        for part in parts:
+            if part[0] + len(data) <= size_limit:
+                break
+        else:
+            # Nothing has room: start a new part (an oversized file gets its own)
+            part = [0, []]
+            parts.append(part)
+        part[0] += len(data)
+        part[1].append((fname, data))
+
+    for part_index, (_, files) in enumerate(parts, start=1):
+        buffer = io.BytesIO()
+        # Fastest deflate level: throughput matters more than ratio here
+        with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+            for fname, data in files:
+                zf.writestr(fname, data, compress_type=_zip_compress_type(fname, data))
+        yield f"attachments_part{part_index}.zip", buffer.getvalue()
+
+
+# A resource cache hands back the same part bytes on every rerun (st.cache_data
+# would unpickle a copy of them each time); kept to the last two results.
+@st.cache_resource(max_entries=2)
+def generate_attachment_zips(_attachments_storage, filter_key, _keys):
+    """
+    Split ZIPs (see create_split_zips) of the attachments under `_keys`,
+    cached on `filter_key` like the other exports.
+    Returns a list of (zip_filename, zip_bytes); treat it as read-only.
+    """
+    return list(create_split_zips({key: _attachments_storage[key] for key in _keys}))
 
 
 # ----------------------------------------
@@ -315,120 +760,119 @@ st.write(
 uploaded = st.file_uploader(
     "Upload a ZIP of .msg files (single ZIP only)", type=["zip"]
 )
+if CACHE_DIR is not None:
+    st.caption(
+        f"Parsed mailboxes (bodies and attachments included) are cached on disk in `{CACHE_DIR}`. "
+        "Delete that folder to clear them; unset EMAIL_FORENSICS_CACHE_DIR to turn caching off."
+    )
 
 if uploaded:
     with st.spinner("Extracting and parsing .msg files…"):
         try:
-            messages, attachments_storage = parse_zip_file(uploaded)
+            messages, attachments_storage, bodies = parse_zip_file(uploaded, uploaded.file_id)
         except Exception as e:
             st.error(f"Failed to parse ZIP: {e}")
             st.stop()
 
-    if not messages:
+    if messages.empty:
         st.info("No `.msg` files were found in the uploaded ZIP.")
         st.stop()
 
-    # Build DataFrame for display/filtering
-    df = pd.DataFrame([{
-        "Date": msg.get("date"),
-        "Subject": msg.get("subject"),
-        "Sender": msg.get("sender"),
-        "Recipients": msg.get("recipients"),
-        "EmailsInBody": msg.get("emails_in_body"),
-        "PhonesInBody": msg.get("phones_in_body"),
-        "AttachmentsCount": len(msg.get("attachments", [])),
-        "Index": i
-    } for i, msg in enumerate(messages)])
-
-    df["Date"] = pd.to_datetime(df["Date"], errors="coerce")
-
-    # Sidebar filters
+    # Sidebar filters, batched in a form: editing a field doesn't rerun the
+    # script, the whole set is applied at once on "Apply filters"
     st.sidebar.header("Filters")
-    subj_filter = st.sidebar.text_input("Subject contains")
-    sender_filter = st.sidebar.text_input("Sender contains")
-    rec_filter = st.sidebar.text_input("Communicated with (email/domain)")
-    email_filter = st.sidebar.text_input("Email in body contains")
-    phone_filter = st.sidebar.text_input("Phone in body contains")
-    body_filter = st.sidebar.text_input("Body contains (any text/address/etc.)")
-    has_attach = st.sidebar.checkbox("Only show messages with attachments")
-    start_date = st.sidebar.date_input("Start date", value=datetime(2000, 1, 1).date())
-    end_date = st.sidebar.date_input("End date", value=datetime.today().date())
-
-    # Apply filters
-    filtered = []
-    for msg in messages:
-        if subj_filter and subj_filter.lower() not in msg["subject"].lower():
-            continue
-        if sender_filter and sender_filter.lower() not in msg["sender"].lower():
-            continue
-        if rec_filter:
-            low = rec_filter.lower()
-            if low not in msg["sender"].lower() and low not in msg["recipients"].lower():
-                continue
-        if email_filter and email_filter.lower() not in msg["emails_in_body"].lower():
-            continue
-        if phone_filter and phone_filter.lower() not in msg["phones_in_body"].lower():
-            continue
-        if body_filter and body_filter.lower() not in msg["body"].lower():
-            continue
-        if has_attach and len(msg["attachments"]) == 0:
-            continue
-        msg_date = msg["date"]
-        if msg_date:
-            if msg_date.date() < start_date or msg_date.date() > end_date:
-                continue
-        filtered.append(msg)
-
-    if filtered:
-        disp_df = pd.DataFrame([{
-            "Date": msg.get("date"),
-            "Subject": msg.get("subject"),
-            "Sender": msg.get("sender"),
-            "Recipients": msg.get("recipients"),
-            "EmailsInBody": msg.get("emails_in_body"),
-            "PhonesInBody": msg.get("phones_in_body"),
-            "AttachmentsCount": len(msg.get("attachments", [])),
-            "Index": i
-        } for i, msg in enumerate(messages) if msg in filtered])
-
-        disp_df["Date"] = disp_df["Date"].dt.strftime("%Y-%m-%d %H:%M:%S")
-        st.dataframe(disp_df.set_index("Index"), height=400)
+    with st.sidebar.form("filters"):
+        subj_filter = st.text_input("Subject contains")
+        sender_filter = st.text_input("Sender contains")
+        rec_filter = st.text_input("Communicated with (email/domain)")
+        email_filter = st.text_input("Email in body contains")
+        phone_filter = st.text_input("Phone in body contains")
+        body_filter = st.text_input("Body contains (any text/address/etc.)")
+        has_attach = st.checkbox("Only show messages with attachments")
+        start_date = st.date_input("Start date", value=datetime(2000, 1, 1).date())
+        end_date = st.date_input("End date", value=datetime.today().date())
+        st.form_submit_button("Apply filters")
+
+    # Filtering is cached on the filter values, so reruns from unrelated
+    # widgets (message selection, download/prepare buttons) skip the scan.
+    # The same small key identifies the filter result for the exporters.
+    filter_key = (
+        uploaded.file_id, subj_filter, sender_filter, rec_filter, email_filter,
+        phone_filter, body_filter, has_attach, start_date, end_date,
+    )
+    filtered_rows = filter_messages(messages, bodies, *filter_key)
+    filtered = messages.loc[list(filtered_rows), list(VIEW_COLUMNS)]
+
+    if not filtered.empty:
+        # Display frame is a column slice of the filtered messages
+        disp_df = pd.DataFrame({
+            "Date": filtered["date"].dt.strftime("%Y-%m-%d %H:%M:%S"),
+            "Subject": filtered["subject"],
+            "Sender": filtered["sender"],
+            "Recipients": filtered["recipients"],
+            "EmailsInBody": filtered["emails_in_body"],
+            "PhonesInBody": filtered["phones_in_body"],
+            "AttachmentsCount": filtered["attachments_count"],
+        })
+        disp_df.index.name = "Index"
+        st.dataframe(disp_df, height=400)
 
         # Download filtered as CSV / PDF
         st.download_button(
             "Download Filtered as CSV",
-            data=generate_csv_download(filtered),
+            data=generate_csv_download(messages, bodies, filter_key, filtered_rows),
             file_name="filtered_emails.csv",
             mime="text/csv",
             key="download_filtered_csv"
         )
-        st.download_button(
-            "Download Filtered as PDF",
-            data=generate_pdf_download(filtered),
-            file_name="filtered_emails.pdf",
-            mime="application/pdf",
-            key="download_filtered_pdf"
-        )
+        # The PDF report is the slow export: only build it once requested
+        # for the current filter result, not on every rerun.
+        pdf_request = filter_key
+        if st.button("Prepare Filtered PDF", key="prepare_filtered_pdf"):
+            st.session_state["filtered_pdf_request"] = pdf_request
+        if st.session_state.get("filtered_pdf_request") == pdf_request:
+            st.download_button(
+                "Download Filtered as PDF",
+                data=generate_pdf_download(messages, filter_key, filtered_rows),
+                file_name="filtered_emails.pdf",
+                mime="application/pdf",
+                key="download_filtered_pdf"
+            )
+
+        # One PDF per filtered message, zipped (also only built on request)
+        if st.button("Prepare Per-Message PDFs (ZIP)", key="prepare_pdfs_zip"):
+            st.session_state["pdfs_zip_request"] = pdf_request
+        if st.session_state.get("pdfs_zip_request") == pdf_request:
+            st.download_button(
+                "Download Per-Message PDFs (ZIP)",
+                data=generate_pdfs_zip(messages, bodies, filter_key, filtered_rows),
+                file_name="filtered_emails_pdfs.zip",
+                mime="application/zip",
+                key="download_pdfs_zip"
+            )
 
         # Split & download all attachments for filtered messages
         filtered_keys = []
-        for msg in filtered:
-            for fname_key in msg["attachments"]:
+        for atts in filtered["attachments"]:
+            for fname_key in atts:
                 _, key = fname_key
                 filtered_keys.append(key)
 
         if filtered_keys:
-            filtered_attachments = {k: attachments_storage[k] for k in filtered_keys}
-            parts = create_split_zips(filtered_attachments)
             st.write("## Download Attachments (Split ZIPs)")
-            for part_name, part_bytes in parts:
-                st.download_button(
-                    f"Download {part_name}",
-                    data=part_bytes,
-                    file_name=part_name,
-                    mime="application/zip",
-                    key=f"download_attach_part_{part_name}"
-                )
+            # Zipping reads every filtered attachment: only build the parts
+            # once requested for the current filter result
+            if st.button("Prepare Attachment ZIPs", key="prepare_attachment_zips"):
+                st.session_state["attachment_zips_request"] = filter_key
+            if st.session_state.get("attachment_zips_request") == filter_key:
+                for part_name, part_bytes in generate_attachment_zips(attachments_storage, filter_key, filtered_keys):
+                    st.download_button(
+                        f"Download {part_name}",
+                        data=part_bytes,
+                        file_name=part_name,
+                        mime="application/zip",
+                        key=f"download_attach_part_{part_name}"
+                    )
         else:
             st.info("No attachments to download for the filtered messages.")
 
@@ -436,9 +880,10 @@ if uploaded:
         st.write("## Message Details & Attachments")
         idx_list = disp_df.index.tolist()
         selected_index = st.selectbox("Select message by Index", options=idx_list, key="select_message")
-        msg = [m for i, m in enumerate(messages) if i == selected_index][0]
+        msg = messages.loc[selected_index]
 
-        st.write(f"**Date:** {msg['date'].strftime('%Y-%m-%d %H:%M:%S')}")
+        date_str = msg["date"].strftime("%Y-%m-%d %H:%M:%S") if pd.notna(msg["date"]) else ""
+        st.write(f"**Date:** {date_str}")
         st.write(f"**Subject:** {msg['subject']}")
         st.write(f"**Sender:** {msg['sender']}")
         st.write(f"**Recipients:** {msg['recipients']}")
@@ -451,22 +896,27 @@ if uploaded:
                 if data:
                     st.download_button(
                         f"Download {fn}",
-                        data=data,
+                        data=bytes(data),
                         file_name=fn,
                         key=f"download_attach_{selected_index}_{att_index}"
                     )
 
         st.write("**Body:**")
-        st.write(msg["body"])
-
-        # Download this message as PDF
-        single_pdf = generate_single_pdf(msg)
-        st.download_button(
-            "Download This Message as PDF",
-            data=single_pdf,
-            file_name=f"message_{selected_index}.pdf",
-            mime="application/pdf",
-            key=f"download_msg_pdf_{selected_index}"
-        )
+        body = load_body(bodies, selected_index)
+        st.write(body)
+
+        # Download this message as PDF (built only once requested)
+        msg_pdf_request = (uploaded.file_id, selected_index)
+        if st.button("Prepare This Message as PDF", key="prepare_msg_pdf"):
+            st.session_state["msg_pdf_request"] = msg_pdf_request
+        if st.session_state.get("msg_pdf_request") == msg_pdf_request:
+            single_pdf = generate_single_pdf(msg, body)
+            st.download_button(
+                "Download This Message as PDF",
+                data=single_pdf,
+                file_name=f"message_{selected_index}.pdf",
+                mime="application/pdf",
+                key=f"download_msg_pdf_{selected_index}"
+            )
     else:
         st.info("No messages match the current filters.")